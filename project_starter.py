@@ -5,11 +5,18 @@ import time
 import dotenv
 import ast
 import json
+import queue
+import re
+import threading
+from concurrent.futures import Future
+from contextlib import contextmanager
+from contextvars import ContextVar
 from datetime import datetime, timedelta
-from typing import Dict, List, Union
+from typing import Callable, Dict, List, Tuple, Union
 from sqlalchemy import create_engine, Engine
-from sqlalchemy.sql import text
 from smolagents import OpenAIServerModel, tool, ToolCallingAgent
+from smolagents.agents import ActionOutput, ToolOutput
+from smolagents.memory import ActionStep, ToolCall
 
 # Create an SQLite database
 db_engine = create_engine("sqlite:///munder_difflin.db")
@@ -132,63 +139,345 @@ def init_database(db_engine: Engine = db_engine, seed: int = 137) -> Engine:
         
         pd.DataFrame(initial_transactions).to_sql("transactions", db_engine, if_exists="append", index=False)
         inventory_df.to_sql("inventory", db_engine, if_exists="replace", index=False)
+        
+        with db_engine.begin() as conn:
+            conn.exec_driver_sql(f"DROP TABLE IF EXISTS {ARCHIVE_TABLE}")
+            conn.exec_driver_sql("DROP TABLE IF EXISTS ledger_partitions")
+        load_ledger_cutoff()
         return db_engine
     except Exception as e:
         print(f"Error initializing database: {e}")
         raise
 
+# QUERY HELPERS
+# Agent tools hit these several times per request, so they read straight from a
+# DBAPI cursor into tuples or __slots__ records instead of building DataFrames.
+
+# Ledger partitions: compact_transactions moves rows dated before a cutoff into
+# ARCHIVE_TABLE and replaces them with opening_stock/opening_cash rows dated at
+# the cutoff. Queries as of the cutoff or later read only the live table; earlier
+# as-of dates are answered from the archive. The {ledger} placeholder in the
+# queries below is filled in by ledger_table().
+ARCHIVE_TABLE = "transactions_archive"
+ledger_cutoff = None
+
+STOCK_LEVEL_QUERY = """
+    SELECT item_name,
+        COALESCE(SUM(CASE
+            WHEN transaction_type IN ('stock_orders', 'opening_stock') THEN units
+            WHEN transaction_type = 'sales' THEN -units
+            ELSE 0
+        END), 0) AS current_stock
+    FROM {ledger}
+    WHERE item_name = :item_name AND transaction_date <= :as_of_date
+"""
+
+ALL_INVENTORY_QUERY = """
+    SELECT item_name,
+        SUM(CASE
+            WHEN transaction_type IN ('stock_orders', 'opening_stock') THEN units
+            WHEN transaction_type = 'sales' THEN -units
+            ELSE 0
+        END) as stock
+    FROM {ledger}
+    WHERE item_name IS NOT NULL AND transaction_date <= :as_of_date
+    GROUP BY item_name
+    HAVING stock > 0
+"""
+
+CASH_BALANCE_QUERY = """
+    SELECT
+        COALESCE(SUM(CASE WHEN transaction_type IN ('sales', 'opening_cash') THEN price ELSE 0 END), 0),
+        COALESCE(SUM(CASE WHEN transaction_type = 'stock_orders' THEN price ELSE 0 END), 0)
+    FROM {ledger}
+    WHERE transaction_date <= :as_of_date
+"""
+
+class StockLevel:
+    """Stock on hand for one item as of a date."""
+    __slots__ = ("item_name", "current_stock")
+
+    def __init__(self, item_name: str, current_stock: float):
+        self.item_name = item_name
+        self.current_stock = current_stock
+
+    def __repr__(self) -> str:
+        return f"StockLevel({self.item_name!r}, {self.current_stock!r})"
+
+class QuoteRecord:
+    """One row of quote history joined with its original request."""
+    __slots__ = ("original_request", "total_amount", "quote_explanation",
+                 "job_type", "order_size", "event_type", "order_date")
+
+    def __init__(self, original_request, total_amount, quote_explanation,
+                 job_type, order_size, event_type, order_date):
+        self.original_request = original_request
+        self.total_amount = total_amount
+        self.quote_explanation = quote_explanation
+        self.job_type = job_type
+        self.order_size = order_size
+        self.event_type = event_type
+        self.order_date = order_date
+
+    def as_dict(self) -> Dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+def query_rows(query: str, params: Dict) -> List[tuple]:
+    conn = db_engine.raw_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(query, params)
+        rows = cursor.fetchall()
+        cursor.close()
+        return rows
+    finally:
+        conn.close()
+
+# Request-scoped memo: within one orchestrated request the agents re-read the same
+# stock and cash figures many times. Reads go through memoized() while a
+# request_memo() scope is active; create_transaction drops exactly the entries a
+# new row can change (same item or any aggregate, as of the row's date or later).
+active_memo: ContextVar = ContextVar("active_memo", default=None)
+# Running totals across closed memo scopes; "requests" counts customer requests,
+# so a batched group scope contributes one per request it handled
+memo_totals: Dict[str, int] = {"requests": 0, "hits": 0, "misses": 0, "invalidations": 0}
+memo_totals_lock = threading.Lock()
+
+class RequestMemo:
+    """Cached ledger reads for one request, keyed by (kind, *args, as_of_date)."""
+    def __init__(self):
+        self.entries: Dict[Tuple, object] = {}
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.generation = 0
+        self.requests = 1
+        self.lock = threading.Lock()
+    
+    def get_or_load(self, key: Tuple, load: Callable):
+        with self.lock:
+            if key in self.entries:
+                self.hits += 1
+                return self.entries[key]
+            self.misses += 1
+            generation = self.generation
+        value = load()
+        with self.lock:
+            # Skip storing if a write landed while this read was in flight
+            if generation == self.generation:
+                self.entries[key] = value
+        return value
+    
+    def invalidate(self, item_name: Union[str, None], transaction_date: str):
+        with self.lock:
+            stale = [
+                key for key in self.entries
+                if key[-1] >= transaction_date and (
+                    key[0] in ("cash_balance", "financial_report")
+                    or (key[0] == "all_inventory" and item_name is not None)
+                    or (key[0] == "stock_level" and key[1] == item_name)
+                )
+            ]
+            for key in stale:
+                del self.entries[key]
+            self.invalidations += len(stale)
+            self.generation += 1
+    
+    def clear(self):
+        with self.lock:
+            self.invalidations += len(self.entries)
+            self.entries.clear()
+            self.generation += 1
+    
+    def stats(self) -> Dict[str, int]:
+        return {"requests": self.requests, "hits": self.hits, "misses": self.misses, "invalidations": self.invalidations}
+
+@contextmanager
+def request_memo():
+    memo = active_memo.get()
+    if memo is not None:
+        yield memo
+        return
+    memo = RequestMemo()
+    token = active_memo.set(memo)
+    try:
+        yield memo
+    finally:
+        active_memo.reset(token)
+        with memo_totals_lock:
+            for name, value in memo.stats().items():
+                memo_totals[name] += value
+
+def memoized(key: Tuple, load: Callable):
+    memo = active_memo.get()
+    return load() if memo is None else memo.get_or_load(key, load)
+
+def memo_summary() -> Dict[str, float]:
+    """Average memo hits, misses and invalidations per customer request."""
+    with memo_totals_lock:
+        requests = memo_totals["requests"] or 1
+        return {name: memo_totals[name] / requests for name in ("hits", "misses", "invalidations")}
+
+def reset_memo_stats():
+    with memo_totals_lock:
+        for name in memo_totals:
+            memo_totals[name] = 0
+
+def ledger_table(as_of_date: str) -> str:
+    return ARCHIVE_TABLE if ledger_cutoff is not None and as_of_date < ledger_cutoff else "transactions"
+
+def load_ledger_cutoff() -> Union[str, None]:
+    global ledger_cutoff
+    try:
+        rows = query_rows("SELECT MAX(cutoff_date) FROM ledger_partitions", {})
+        ledger_cutoff = rows[0][0]
+    except Exception:
+        ledger_cutoff = None
+    return ledger_cutoff
+
+def fetch_stock_level(item_name: str, as_of_date: Union[str, datetime]) -> StockLevel:
+    if isinstance(as_of_date, datetime):
+        as_of_date = as_of_date.isoformat()
+    query = STOCK_LEVEL_QUERY.format(ledger=ledger_table(as_of_date))
+    return memoized(
+        ("stock_level", item_name, as_of_date),
+        lambda: StockLevel(*query_rows(query, {"item_name": item_name, "as_of_date": as_of_date})[0])
+    )
+
+def fetch_quote_history(search_terms: List[str], limit: int = 5) -> List[QuoteRecord]:
+    conditions = []
+    params = {"limit": limit}
+    
+    for i, term in enumerate(search_terms):
+        param_name = f"term_{i}"
+        conditions.append(
+            f"(LOWER(qr.response) LIKE :{param_name} OR "
+            f"LOWER(q.quote_explanation) LIKE :{param_name})"
+        )
+        params[param_name] = f"%{term.lower()}%"
+    
+    where_clause = " AND ".join(conditions) if conditions else "1=1"
+    
+    query = f"""
+        SELECT qr.response AS original_request, q.total_amount, q.quote_explanation,
+            q.job_type, q.order_size, q.event_type, q.order_date
+        FROM quotes q
+        JOIN quote_requests qr ON q.request_id = qr.id
+        WHERE {where_clause}
+        ORDER BY q.order_date DESC
+        LIMIT :limit
+    """
+    return [QuoteRecord(*row) for row in query_rows(query, params)]
+
 def create_transaction(item_name: str, transaction_type: str, quantity: int, price: float, date: Union[str, datetime]) -> int:
     try:
         date_str = date.isoformat() if isinstance(date, datetime) else date
         if transaction_type not in {"stock_orders", "sales"}:
             raise ValueError("Transaction type must be 'stock_orders' or 'sales'")
+        if ledger_cutoff is not None and date_str < ledger_cutoff:
+            raise ValueError(f"Transaction date must not be before the ledger cutoff {ledger_cutoff}")
         
-        transaction = pd.DataFrame([{
-            "item_name": item_name,
-            "transaction_type": transaction_type,
-            "units": quantity,
-            "price": price,
-            "transaction_date": date_str
-        }])
-        
-        transaction.to_sql("transactions", db_engine, if_exists="append", index=False)
-        result = pd.read_sql("SELECT last_insert_rowid() as id", db_engine)
-        return int(result.iloc[0]["id"])
+        conn = db_engine.raw_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute(
+                "INSERT INTO transactions (item_name, transaction_type, units, price, transaction_date) "
+                "VALUES (:item_name, :transaction_type, :units, :price, :transaction_date)",
+                {"item_name": item_name, "transaction_type": transaction_type,
+                 "units": quantity, "price": price, "transaction_date": date_str}
+            )
+            conn.commit()
+            transaction_id = cursor.lastrowid
+            cursor.close()
+        finally:
+            conn.close()
+        
+        memo = active_memo.get()
+        if memo is not None:
+            memo.invalidate(item_name, date_str)
+        return int(transaction_id)
     except Exception as e:
         print(f"Error creating transaction: {e}")
         raise
 
-def get_all_inventory(as_of_date: str) -> Dict[str, int]:
-    query = """
-        SELECT item_name,
-            SUM(CASE
-                WHEN transaction_type = 'stock_orders' THEN units
-                WHEN transaction_type = 'sales' THEN -units
-                ELSE 0
-            END) as stock
-        FROM transactions
-        WHERE item_name IS NOT NULL AND transaction_date <= :as_of_date
-        GROUP BY item_name
-        HAVING stock > 0
+def compact_transactions(cutoff_date: str) -> Dict:
     """
-    result = pd.read_sql(query, db_engine, params={"as_of_date": as_of_date})
-    return dict(zip(result["item_name"], result["stock"]))
-
-def get_stock_level(item_name: str, as_of_date: Union[str, datetime]) -> pd.DataFrame:
-    if isinstance(as_of_date, datetime):
-        as_of_date = as_of_date.isoformat()
+    Move transactions dated before cutoff_date (YYYY-MM-DD) into the archive table.
     
-    stock_query = """
-        SELECT item_name,
-            COALESCE(SUM(CASE
-                WHEN transaction_type = 'stock_orders' THEN units
-                WHEN transaction_type = 'sales' THEN -units
-                ELSE 0
-            END), 0) AS current_stock
-        FROM transactions
-        WHERE item_name = :item_name AND transaction_date <= :as_of_date
+    The moved rows are replaced by one opening_stock row per item and one
+    opening_cash row, all dated cutoff_date, so balances from the cutoff onward
+    are unchanged. Opening rows from an earlier compaction are dropped rather
+    than archived because they are derived from rows already in the archive.
+    After compaction create_transaction rejects rows dated before the cutoff,
+    since as-of queries for those dates read only the archive.
     """
-    return pd.read_sql(stock_query, db_engine, params={"item_name": item_name, "as_of_date": as_of_date})
+    global ledger_cutoff
+    if ledger_cutoff is not None and cutoff_date <= ledger_cutoff:
+        raise ValueError(f"Cutoff must be after the current ledger cutoff {ledger_cutoff}")
+    
+    params = {"cutoff_date": cutoff_date}
+    conn = db_engine.raw_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(f"CREATE TABLE IF NOT EXISTS {ARCHIVE_TABLE} AS SELECT * FROM transactions WHERE 0")
+        cursor.execute("CREATE TABLE IF NOT EXISTS ledger_partitions (cutoff_date TEXT, archived_rows INTEGER)")
+        
+        cursor.execute(
+            "SELECT item_name, SUM(CASE "
+            "WHEN transaction_type IN ('stock_orders', 'opening_stock') THEN units "
+            "WHEN transaction_type = 'sales' THEN -units ELSE 0 END) "
+            "FROM transactions WHERE item_name IS NOT NULL AND transaction_date < :cutoff_date "
+            "GROUP BY item_name", params
+        )
+        opening_stock = cursor.fetchall()
+        cursor.execute(
+            "SELECT "
+            "COALESCE(SUM(CASE WHEN transaction_type IN ('sales', 'opening_cash') THEN price ELSE 0 END), 0), "
+            "COALESCE(SUM(CASE WHEN transaction_type = 'stock_orders' THEN price ELSE 0 END), 0) "
+            "FROM transactions WHERE transaction_date < :cutoff_date", params
+        )
+        total_sales, total_purchases = cursor.fetchone()
+        
+        cursor.execute(
+            f"INSERT INTO {ARCHIVE_TABLE} SELECT * FROM transactions "
+            "WHERE transaction_date < :cutoff_date AND transaction_type IN ('stock_orders', 'sales')", params
+        )
+        archived_rows = cursor.rowcount
+        cursor.execute("DELETE FROM transactions WHERE transaction_date < :cutoff_date", params)
+        
+        opening_rows = [(name, "opening_stock", units, None, cutoff_date) for name, units in opening_stock]
+        opening_rows.append((None, "opening_cash", None, total_sales - total_purchases, cutoff_date))
+        cursor.executemany(
+            "INSERT INTO transactions (item_name, transaction_type, units, price, transaction_date) "
+            "VALUES (?, ?, ?, ?, ?)", opening_rows
+        )
+        cursor.execute("INSERT INTO ledger_partitions VALUES (:cutoff_date, :archived_rows)",
+                       {"cutoff_date": cutoff_date, "archived_rows": archived_rows})
+        conn.commit()
+        cursor.close()
+    except Exception as e:
+        conn.rollback()
+        print(f"Error compacting transactions: {e}")
+        raise
+    finally:
+        conn.close()
+    
+    ledger_cutoff = cutoff_date
+    memo = active_memo.get()
+    if memo is not None:
+        memo.clear()
+    return {
+        "cutoff_date": cutoff_date, "archived_rows": archived_rows,
+        "opening_items": len(opening_stock), "opening_cash": total_sales - total_purchases
+    }
+
+def get_all_inventory(as_of_date: str) -> Dict[str, int]:
+    query = ALL_INVENTORY_QUERY.format(ledger=ledger_table(as_of_date))
+    return memoized(("all_inventory", as_of_date), lambda: dict(query_rows(query, {"as_of_date": as_of_date})))
+
+def get_stock_level(item_name: str, as_of_date: Union[str, datetime]) -> pd.DataFrame:
+    record = fetch_stock_level(item_name, as_of_date)
+    return pd.DataFrame([{"item_name": record.item_name, "current_stock": record.current_stock}])
 
 def get_supplier_delivery_date(input_date_str: str, quantity: int) -> str:
     try:
@@ -213,16 +502,11 @@ def get_cash_balance(as_of_date: Union[str, datetime]) -> float:
         if isinstance(as_of_date, datetime):
             as_of_date = as_of_date.isoformat()
         
-        transactions = pd.read_sql(
-            "SELECT * FROM transactions WHERE transaction_date <= :as_of_date",
-            db_engine, params={"as_of_date": as_of_date}
+        query = CASH_BALANCE_QUERY.format(ledger=ledger_table(as_of_date))
+        total_sales, total_purchases = memoized(
+            ("cash_balance", as_of_date), lambda: query_rows(query, {"as_of_date": as_of_date})[0]
         )
-        
-        if not transactions.empty:
-            total_sales = transactions.loc[transactions["transaction_type"] == "sales", "price"].sum()
-            total_purchases = transactions.loc[transactions["transaction_type"] == "stock_orders", "price"].sum()
-            return float(total_sales - total_purchases)
-        return 0.0
+        return float(total_sales - total_purchases)
     except Exception as e:
         print(f"Error getting cash balance: {e}")
         return 0.0
@@ -230,33 +514,40 @@ def get_cash_balance(as_of_date: Union[str, datetime]) -> float:
 def generate_financial_report(as_of_date: Union[str, datetime]) -> Dict:
     if isinstance(as_of_date, datetime):
         as_of_date = as_of_date.isoformat()
-    
+    return memoized(("financial_report", as_of_date), lambda: build_financial_report(as_of_date))
+
+def build_financial_report(as_of_date: str) -> Dict:
     cash = get_cash_balance(as_of_date)
-    inventory_df = pd.read_sql("SELECT * FROM inventory", db_engine)
+    inventory_rows = query_rows("SELECT item_name, unit_price FROM inventory", {})
     inventory_value = 0.0
     inventory_summary = []
     
-    for _, item in inventory_df.iterrows():
-        stock_info = get_stock_level(item["item_name"], as_of_date)
-        stock = stock_info["current_stock"].iloc[0]
-        item_value = stock * item["unit_price"]
+    for item_name, unit_price in inventory_rows:
+        stock = fetch_stock_level(item_name, as_of_date).current_stock
+        item_value = stock * unit_price
         inventory_value += item_value
         
         inventory_summary.append({
-            "item_name": item["item_name"], "stock": stock,
-            "unit_price": item["unit_price"], "value": item_value
+            "item_name": item_name, "stock": stock,
+            "unit_price": unit_price, "value": item_value
         })
     
-    top_sales_query = """
+    # Sales history is not carried forward by compaction, so read both partitions
+    sales_ledger = "transactions" if ledger_cutoff is None else (
+        f"(SELECT * FROM transactions UNION ALL SELECT * FROM {ARCHIVE_TABLE})"
+    )
+    top_sales_query = f"""
         SELECT item_name, SUM(units) as total_units, SUM(price) as total_revenue
-        FROM transactions
+        FROM {sales_ledger}
         WHERE transaction_type = 'sales' AND transaction_date <= :date
         GROUP BY item_name
         ORDER BY total_revenue DESC
         LIMIT 5
     """
-    top_sales = pd.read_sql(top_sales_query, db_engine, params={"date": as_of_date})
-    top_selling_products = top_sales.to_dict(orient="records")
+    top_selling_products = [
+        {"item_name": name, "total_units": units, "total_revenue": revenue}
+        for name, units, revenue in query_rows(top_sales_query, {"date": as_of_date})
+    ]
     
     return {
         "as_of_date": as_of_date, "cash_balance": cash, "inventory_value": inventory_value,
@@ -266,32 +557,9 @@ def generate_financial_report(as_of_date: Union[str, datetime]) -> Dict:
     }
 
 def search_quote_history(search_terms: List[str], limit: int = 5) -> List[Dict]:
-    conditions = []
-    params = {}
-    
-    for i, term in enumerate(search_terms):
-        param_name = f"term_{i}"
-        conditions.append(
-            f"(LOWER(qr.response) LIKE :{param_name} OR "
-            f"LOWER(q.quote_explanation) LIKE :{param_name})"
-        )
-        params[param_name] = f"%{term.lower()}%"
-    
-    where_clause = " AND ".join(conditions) if conditions else "1=1"
-    
-    query = f"""
-        SELECT qr.response AS original_request, q.total_amount, q.quote_explanation,
-            q.job_type, q.order_size, q.event_type, q.order_date
-        FROM quotes q
-        JOIN quote_requests qr ON q.request_id = qr.id
-        WHERE {where_clause}
-        ORDER BY q.order_date DESC
-        LIMIT {limit}
-    """
-    
-    with db_engine.connect() as conn:
-        result = conn.execute(text(query), params)
-        return [dict(row._mapping) for row in result]
+    return [record.as_dict() for record in fetch_quote_history(search_terms, limit)]
+
+load_ledger_cutoff()
 
 # AGENT TOOLS
 @tool
@@ -313,15 +581,11 @@ def check_inventory_availability(items_json: str, check_date: str) -> str:
             name = item["item_name"]
             qty = item["quantity"]
             
-            stock_df = get_stock_level(name, check_date)
-            if stock_df.empty or len(stock_df) == 0:
-                results.append(f"X {name}: NOT IN INVENTORY")
+            current_stock = int(fetch_stock_level(name, check_date).current_stock)
+            if current_stock >= qty:
+                results.append(f"OK {name}: {current_stock} available (requested {qty})")
             else:
-                current_stock = int(stock_df.iloc[0]["current_stock"])
-                if current_stock >= qty:
-                    results.append(f"OK {name}: {current_stock} available (requested {qty})")
-                else:
-                    results.append(f"WARNING {name}: Only {current_stock} available (requested {qty}, short {qty-current_stock})")
+                results.append(f"WARNING {name}: Only {current_stock} available (requested {qty}, short {qty-current_stock})")
         
         return "\n".join(results)
     except Exception as e:
@@ -339,7 +603,7 @@ def search_past_quotes(keywords: str) -> str:
     """
     try:
         terms = [k.strip() for k in keywords.split(",")]
-        quotes = search_quote_history(terms, 5)
+        quotes = fetch_quote_history(terms, 5)
         
         if not quotes:
             return "No similar quotes found."
@@ -347,9 +611,9 @@ def search_past_quotes(keywords: str) -> str:
         output = []
         for i, q in enumerate(quotes, 1):
             output.append(f"\n=== Quote {i} ===")
-            output.append(f"Event: {q.get('event_type','N/A')}, Size: {q.get('order_size','N/A')}")
-            output.append(f"Amount: ${q['total_amount']:.2f}")
-            output.append(f"Details: {q['quote_explanation'][:120]}...")
+            output.append(f"Event: {q.event_type}, Size: {q.order_size}")
+            output.append(f"Amount: ${q.total_amount:.2f}")
+            output.append(f"Details: {q.quote_explanation[:120]}...")
         
         return "\n".join(output)
     except Exception as e:
@@ -421,11 +685,7 @@ def process_customer_sale(items_json: str, sale_date: str) -> str:
         items = json.loads(items_json)
         
         for item in items:
-            stock_df = get_stock_level(item["item_name"], sale_date)
-            if stock_df.empty:
-                return f"X SALE FAILED: {item['item_name']} not in inventory"
-            
-            stock = int(stock_df.iloc[0]["current_stock"])
+            stock = int(fetch_stock_level(item["item_name"], sale_date).current_stock)
             if stock < item["quantity"]:
                 return f"X SALE FAILED: Insufficient {item['item_name']} (have {stock}, need {item['quantity']})"
         
@@ -444,7 +704,15 @@ def process_customer_sale(items_json: str, sale_date: str) -> str:
             
             create_transaction(name, "sales", qty, amount, sale_date)
         
-        return f"OK SALE PROCESSED! Total revenue: ${total:.2f}"
+        low_stock = []
+        for item in items:
+            name = item["item_name"]
+            min_level = query_rows("SELECT min_stock_level FROM inventory WHERE item_name = :item_name", {"item_name": name})
+            remaining = int(fetch_stock_level(name, sale_date).current_stock)
+            if min_level and remaining < min_level[0][0]:
+                low_stock.append(f"LOW STOCK: {name} ({remaining} left, minimum {min_level[0][0]})")
+        
+        return "\n".join([f"OK SALE PROCESSED! Total revenue: ${total:.2f}"] + low_stock)
     except Exception as e:
         return f"X Error: {str(e)}"
 
@@ -566,9 +834,132 @@ model = OpenAIServerModel(
 # MULTI-AGENT SYSTEM
 ########################
 
+# Step budgets are sized from the last STEP_STATS_WINDOW recorded runs of each agent
+STEP_STATS_PATH = "agent_step_stats.json"
+STEP_STATS_WINDOW = 50
+STEP_STATS_MIN_RUNS = 5
+MIN_STEP_BUDGET = 3
+# A run ends once the model repeats the same call this many times in later steps
+MAX_REPEATED_CALLS = 2
+
+class BudgetedToolCallingAgent(ToolCallingAgent):
+    """
+    ToolCallingAgent with an adaptive step budget and early termination.
+    
+    The budget is one step above the 95th percentile of recorded single-request
+    run lengths, capped at max_steps. A tool call identical to one already made in the same
+    run is executed only once, including identical calls run in parallel within one step;
+    a step that runs one of write_tools invalidates the calls made in earlier steps. A
+    repeated call is answered with a note pointing back to its earlier result, and a run
+    ends once the model repeats the same call MAX_REPEATED_CALLS times in later steps.
+    With early_exit, a run stops as soon as every tool called in a step (repeated or not)
+    is a terminal tool whose output fully answers the task.
+    """
+    def __init__(self, tools: List, model, terminal_tools: Dict[str, Callable[[str], bool]] = None,
+                 write_tools: Tuple[str, ...] = (), **kwargs):
+        super().__init__(tools=tools, model=model, **kwargs)
+        self.terminal_tools = terminal_tools or {}
+        self.write_tools = set(write_tools)
+        self.step_history: List[int] = []
+        self.early_exit = True
+        self.tool_call_lock = threading.Lock()
+        self.tool_call_results: Dict[Tuple[str, str], Future] = {}
+        self.repeat_counts: Dict[Tuple[str, str], int] = {}
+    
+    def step_budget(self) -> int:
+        if len(self.step_history) < STEP_STATS_MIN_RUNS:
+            return self.max_steps
+        recent = sorted(self.step_history[-STEP_STATS_WINDOW:])
+        p95 = recent[int(0.95 * (len(recent) - 1))]
+        return max(MIN_STEP_BUDGET, min(self.max_steps, p95 + 1))
+    
+    def run(self, task: str, max_steps: int = None, early_exit: bool = True, **kwargs):
+        """
+        Run the task within the learned step budget. Runs given an explicit
+        max_steps (batched group runs) are not recorded, so they neither skew
+        nor are limited by the single-request budget.
+        """
+        self.early_exit = early_exit
+        self.tool_call_results = {}
+        self.repeat_counts = {}
+        result = super().run(task, max_steps=max_steps or self.step_budget(), **kwargs)
+        if max_steps is None:
+            self.step_history.append(sum(isinstance(step, ActionStep) for step in self.memory.steps))
+        return result
+    
+    @staticmethod
+    def tool_call_key(tool_name: str, arguments) -> Tuple[str, str]:
+        return (tool_name, json.dumps(arguments, sort_keys=True, default=str))
+    
+    def execute_tool_call(self, tool_name: str, arguments):
+        if tool_name == "final_answer":
+            return super().execute_tool_call(tool_name, arguments)
+        call_key = self.tool_call_key(tool_name, arguments)
+        # Reserve the call under the lock so identical parallel calls wait for one execution
+        with self.tool_call_lock:
+            pending = self.tool_call_results.get(call_key)
+            reserved = pending is None
+            if reserved:
+                pending = self.tool_call_results[call_key] = Future()
+        if not reserved:
+            return pending.result()
+        
+        try:
+            result = super().execute_tool_call(tool_name, arguments)
+        except Exception as e:
+            with self.tool_call_lock:
+                self.tool_call_results.pop(call_key, None)
+            pending.set_exception(e)
+            raise
+        pending.set_result(result)
+        return result
+    
+    def _step_stream(self, memory_step: ActionStep):
+        step_keys = set()
+        repeated_ids = set()
+        ran_write = False
+        tool_outputs = []
+        for output in super()._step_stream(memory_step):
+            # Tool calls are all announced before any of them runs
+            if isinstance(output, ToolCall) and output.name != "final_answer":
+                call_key = self.tool_call_key(output.name, output.arguments or {})
+                if call_key in self.tool_call_results:
+                    self.repeat_counts[call_key] = self.repeat_counts.get(call_key, 0) + 1
+                    repeated_ids.add(output.id)
+                elif call_key in step_keys:
+                    repeated_ids.add(output.id)
+                else:
+                    ran_write = ran_write or output.name in self.write_tools
+                step_keys.add(call_key)
+            elif isinstance(output, ToolOutput) and not output.is_final_answer:
+                if output.id in repeated_ids and not (self.early_exit and self.is_terminal_output(output)):
+                    output.observation = (
+                        f"{output.tool_call.name} was already called with these arguments; its result above "
+                        "is unchanged. Do not call it again: use another tool or give your final answer."
+                    )
+                tool_outputs.append(output)
+            elif isinstance(output, ActionOutput) and not output.is_final_answer:
+                if self.early_exit and tool_outputs and all(self.is_terminal_output(o) for o in tool_outputs):
+                    output = ActionOutput(
+                        output="\n".join(tool_output.observation for tool_output in tool_outputs),
+                        is_final_answer=True
+                    )
+                elif any(count >= MAX_REPEATED_CALLS for count in self.repeat_counts.values()):
+                    output = ActionOutput(output=self.provide_final_answer(self.task).content, is_final_answer=True)
+            yield output
+        if ran_write:
+            self.tool_call_results = {
+                key: pending for key, pending in self.tool_call_results.items() if key in step_keys
+            }
+            self.repeat_counts = {}
+    
+    def is_terminal_output(self, tool_output: ToolOutput) -> bool:
+        answers_task = self.terminal_tools.get(tool_output.tool_call.name)
+        return answers_task is not None and answers_task(tool_output.observation)
+
 # Worker Agent 1: Inventory Agent
 # Responsible for stock checking, inventory reporting, and financial status
-inventory_agent = ToolCallingAgent(
+inventory_agent = BudgetedToolCallingAgent(
     tools=[
         check_inventory_availability,
         get_full_inventory_report,
@@ -576,35 +967,159 @@ inventory_agent = ToolCallingAgent(
         get_financial_summary
     ],
     model=model,
+    terminal_tools={
+        "check_inventory_availability": lambda observation: not observation.startswith("Error")
+    },
     max_steps=10
 )
 
 # Worker Agent 2: Quotation Agent
 # Responsible for pricing, quote generation, and historical analysis
-quotation_agent = ToolCallingAgent(
+quotation_agent = BudgetedToolCallingAgent(
     tools=[
         search_past_quotes,
         create_quote
     ],
     model=model,
+    terminal_tools={
+        "create_quote": lambda observation: "TOTAL:" in observation and "NOT IN CATALOG" not in observation
+    },
     max_steps=10
 )
 
 # Worker Agent 3: Sales-Fulfillment Agent
 # Responsible for order processing and supplier restocking
-sales_agent = ToolCallingAgent(
+sales_agent = BudgetedToolCallingAgent(
     tools=[
         process_customer_sale,
         restock_from_supplier
     ],
     model=model,
+    terminal_tools={
+        # A sale that leaves items below their minimum still needs restock steps; the
+        # agent finishes those itself since one restock may not cover every low item
+        "process_customer_sale": lambda observation: observation.startswith("OK SALE PROCESSED") and "LOW STOCK" not in observation
+    },
+    write_tools=("process_customer_sale", "restock_from_supplier"),
     max_steps=10
 )
 
+worker_agents = {
+    "inventory_agent": inventory_agent,
+    "quotation_agent": quotation_agent,
+    "sales_agent": sales_agent
+}
+
+def load_step_stats(path: str = STEP_STATS_PATH):
+    if not os.path.exists(path):
+        return
+    with open(path) as f:
+        stats = json.load(f)
+    for name, agent in worker_agents.items():
+        agent.step_history = stats.get(name, [])[-STEP_STATS_WINDOW:]
+
+def save_step_stats(path: str = STEP_STATS_PATH):
+    with open(path, "w") as f:
+        json.dump({name: agent.step_history[-STEP_STATS_WINDOW:] for name, agent in worker_agents.items()}, f)
+
+def average_steps_per_run() -> Dict[str, float]:
+    return {
+        name: sum(agent.step_history) / len(agent.step_history) if agent.step_history else 0.0
+        for name, agent in worker_agents.items()
+    }
+
+########################
+# CATALOG CONTEXT
+########################
+
+# The catalog block goes into the inventory prompts, where item names are mapped;
+# the quotation and sales agents get exact names from the inventory and quote results.
+# It is rendered once per date and reused verbatim until an item moves between the
+# out / low / ok availability bands, so prompts stay stable.
+CATALOG_CACHE_SIZE = 32
+catalog_cache: Dict[str, Tuple[Tuple[str, ...], str]] = {}
+
+def availability_bands(as_of_date: str) -> Tuple[str, ...]:
+    """Availability band of every catalog item, in paper_supplies order."""
+    stock = get_all_inventory(as_of_date)
+    min_levels = dict(query_rows("SELECT item_name, min_stock_level FROM inventory", {}))
+    bands = []
+    for item in paper_supplies:
+        units = stock.get(item["item_name"], 0)
+        if units <= 0:
+            bands.append("out")
+        elif units < (min_levels.get(item["item_name"]) or 0):
+            bands.append("low")
+        else:
+            bands.append("ok")
+    return tuple(bands)
+
+BAND_MARKS = {"out": "*", "low": "!", "ok": ""}
+
+def render_catalog(bands: Tuple[str, ...]) -> str:
+    names = ", ".join(item["item_name"] + BAND_MARKS[band] for item, band in zip(paper_supplies, bands))
+    return f"Catalog item names (* out of stock, ! below minimum): {names}"
+
+def catalog_context(as_of_date: str) -> str:
+    """Catalog block to place ahead of the request in agent prompts."""
+    bands = availability_bands(as_of_date)
+    cached = catalog_cache.get(as_of_date)
+    if cached is None or cached[0] != bands:
+        if cached is None and len(catalog_cache) >= CATALOG_CACHE_SIZE:
+            catalog_cache.pop(next(iter(catalog_cache)))
+        catalog_cache[as_of_date] = (bands, render_catalog(bands) + "\n\n")
+    return catalog_cache[as_of_date][1]
+
 ########################
 # ORCHESTRATOR
 ########################
 
+def is_order_request(request_text: str) -> bool:
+    return any(keyword in request_text.lower() for keyword in ['order', 'buy', 'purchase', 'place an order'])
+
+def complete_request(request_text: str, request_date: str, inventory_response: str, quote_response: str) -> str:
+    """
+    Run the sales step (for orders) and synthesize the customer-facing response
+    from the inventory and quotation results.
+    """
+    is_order = is_order_request(request_text)
+    
+    # Step 3: If it's an order, process the sale (Sales Agent)
+    if is_order:
+        sales_prompt = f"""Today is {request_date}.
+
+Customer request: {request_text}
+Inventory status: {inventory_response}
+Quote: {quote_response}
+
+Task: Process the customer order.
+- Use process_customer_sale with the exact item names from the quote to record the transaction
+- After sale, check if restocking is needed
+- If inventory is low and funds available, use restock_from_supplier
+
+Provide confirmation of the sale and any restock actions."""
+
+        sales_response = sales_agent.run(sales_prompt)
+    
+    # Synthesize final customer response
+    if is_order:
+        final_response = f"""Thank you for your order!
+
+{quote_response}
+
+{sales_response}
+
+Your order has been processed. We appreciate your business!"""
+    else:
+        final_response = f"""Thank you for your inquiry!
+
+{quote_response}
+
+All quoted items are based on current availability. Please let us know if you'd like to proceed with this order."""
+    
+    return final_response
+
+@request_memo()
 def orchestrate_request(request_text: str, request_date: str) -> str:
     """
     Orchestrator that coordinates multiple agents to handle customer requests.
@@ -620,31 +1135,21 @@ def orchestrate_request(request_text: str, request_date: str) -> str:
         Final customer-facing response
     """
     try:
-        # Determine if this is a quote request or an order
-        is_order = any(keyword in request_text.lower() for keyword in ['order', 'buy', 'purchase', 'place an order'])
-        
         # Extract items from request (simplified - could be enhanced with better parsing)
         # For now, we'll let the agents handle the extraction
         
-        responses = []
-        
         # Step 1: Check inventory availability (Inventory Agent)
         inventory_prompt = f"""Today is {request_date}.
 
-Customer request: {request_text}
+{catalog_context(request_date)}Customer request: {request_text}
 
 Task: Check if we have the requested items in stock.
 - Extract item names and quantities from the request
 - Map informal names to exact catalog names (e.g., "glossy paper" to "Glossy paper")
 - Use check_inventory_availability to verify stock levels
-- Report availability status
-
-Available items include: A4 paper, Cardstock, Colored paper, Glossy paper, Matte paper, Poster paper, 
-Construction paper, Photo paper, Paper plates, Paper cups, Paper napkins, Envelopes, Sticky notes, 
-Notepads, Invitation cards, Flyers, Party streamers, and more."""
+- Report availability status"""
 
         inventory_response = inventory_agent.run(inventory_prompt)
-        responses.append(f"INVENTORY CHECK:\n{inventory_response}")
         
         # Step 2: Generate quote (Quotation Agent)
         quote_prompt = f"""Today is {request_date}.
@@ -653,6 +1158,7 @@ Customer request: {request_text}
 Inventory status: {inventory_response}
 
 Task: Generate a professional price quote.
+- Use the exact item names from the inventory status
 - Search for similar past quotes for pricing guidance
 - Calculate prices with bulk discounts (15% for 1000+, 10% for 500+, 5% for 100+)
 - Provide detailed line-item breakdown
@@ -661,53 +1167,239 @@ Task: Generate a professional price quote.
 Use create_quote to generate the final quote."""
 
         quote_response = quotation_agent.run(quote_prompt)
-        responses.append(f"QUOTE:\n{quote_response}")
         
-        # Step 3: If it's an order, process the sale (Sales Agent)
-        if is_order:
-            sales_prompt = f"""Today is {request_date}.
+        return complete_request(request_text, request_date, inventory_response, quote_response)
+        
+    except Exception as e:
+        print(f"Orchestrator error: {str(e)}")
+        return f"We apologize, but we encountered an issue processing your request. Please contact our support team. (Error: {str(e)[:100]})"
 
-Customer request: {request_text}
-Inventory status: {inventory_response}
-Quote: {quote_response}
+########################
+# REQUEST BATCHING
+########################
 
-Task: Process the customer order.
-- Use process_customer_sale to record the transaction
-- After sale, check if restocking is needed
-- If inventory is low and funds available, use restock_from_supplier
+# Requests wait at most this long for others to join their batch
+BATCH_WINDOW_SECONDS = 0.5
+MAX_BATCH_SIZE = 8
 
-Provide confirmation of the sale and any restock actions."""
+def parse_batched_answer(answer) -> Dict[int, str]:
+    """Split a batched agent answer ({"1": "...", "2": "..."}) into per-request results."""
+    if isinstance(answer, str):
+        start, end = answer.find("{"), answer.rfind("}")
+        if start == -1 or end <= start:
+            return {}
+        try:
+            answer = json.loads(answer[start:end + 1])
+        except json.JSONDecodeError:
+            return {}
+    if not isinstance(answer, dict):
+        return {}
+    
+    results = {}
+    for key, value in answer.items():
+        try:
+            results[int(key)] = value if isinstance(value, str) else json.dumps(value)
+        except (TypeError, ValueError):
+            continue
+    return results
 
-            sales_response = sales_agent.run(sales_prompt)
-            responses.append(f"ORDER PROCESSING:\n{sales_response}")
-        
-        # Synthesize final customer response
-        if is_order:
-            final_response = f"""Thank you for your order!
+def batch_step_budget(agent: BudgetedToolCallingAgent, batch_size: int) -> int:
+    """Step budget for a batched run: the agent's cap plus one step per request (e.g. one create_quote each)."""
+    return agent.max_steps + batch_size
 
-{quote_response}
+def format_batched_requests(request_texts: List[str]) -> str:
+    return "\n\n".join(f"REQUEST {i}: {request_text}" for i, request_text in enumerate(request_texts, 1))
 
-{sales_response}
+# Item lines of a check_inventory_availability report, e.g. "OK A4 paper: 800 available (requested 500)"
+AVAILABILITY_LINE = re.compile(r"^(?:OK|WARNING) (.+?): .*?\(requested (\d+)", re.MULTILINE)
 
-Your order has been processed. We appreciate your business!"""
+def recheck_availability(inventory_status: str, check_date: str) -> Union[str, None]:
+    """Re-run check_inventory_availability for the items of an availability report, or None if none are listed."""
+    items = [{"item_name": name, "quantity": int(qty)} for name, qty in AVAILABILITY_LINE.findall(inventory_status)]
+    if not items:
+        return None
+    return check_inventory_availability(items_json=json.dumps(items), check_date=check_date)
+
+@request_memo()
+def orchestrate_request_group(request_texts: List[str], request_date: str) -> List[str]:
+    """
+    Handle several same-day requests with one inventory and one quotation agent run.
+    
+    Requests whose results cannot be recovered from the batched answers fall back
+    to orchestrate_request. Once a request in the group has been sold, the
+    availability of each later request is re-checked before its own sale, and
+    it falls back to orchestrate_request if its report lists no items to re-check.
+    """
+    # The group shares one memo scope; count each of its requests in the memo stats
+    active_memo.get().requests = len(request_texts)
+    requests_block = format_batched_requests(request_texts)
+    
+    inventory_prompt = f"""Today is {request_date}.
+
+{catalog_context(request_date)}You are handling {len(request_texts)} customer requests at once, labelled REQUEST 1 to REQUEST {len(request_texts)}.
+
+{requests_block}
+
+Task: Check if we have the requested items in stock for every request.
+- Extract item names and quantities from each request
+- Map informal names to exact catalog names (e.g., "glossy paper" to "Glossy paper")
+- Call check_inventory_availability once with the items of all requests combined
+- Report availability status per request
+
+Your final answer must be a JSON object mapping each request number to its availability report,
+e.g. {{"1": "OK A4 paper: 800 available (requested 500)", "2": "..."}}."""
+
+    inventory_results = parse_batched_answer(inventory_agent.run(
+        inventory_prompt, max_steps=batch_step_budget(inventory_agent, len(request_texts)), early_exit=False
+    ))
+    
+    inventory_block = "\n".join(
+        f"REQUEST {i} inventory status: {inventory_results.get(i, 'unknown')}"
+        for i in range(1, len(request_texts) + 1)
+    )
+    quote_prompt = f"""Today is {request_date}.
+
+You are handling {len(request_texts)} customer requests at once, labelled REQUEST 1 to REQUEST {len(request_texts)}.
+
+{requests_block}
+
+{inventory_block}
+
+Task: Generate a professional price quote for every request.
+- Use the exact item names from the inventory status
+- Search for similar past quotes for pricing guidance
+- Calculate prices with bulk discounts (15% for 1000+, 10% for 500+, 5% for 100+)
+- Provide detailed line-item breakdown
+- Show transparent pricing
+
+Use create_quote once per request to generate its quote. Your final answer must be a JSON object
+mapping each request number to its quote text, e.g. {{"1": "...", "2": "..."}}."""
+
+    quote_results = parse_batched_answer(quotation_agent.run(
+        quote_prompt, max_steps=batch_step_budget(quotation_agent, len(request_texts)), early_exit=False
+    ))
+    
+    responses = []
+    sold = False
+    for i, request_text in enumerate(request_texts, 1):
+        inventory_status = inventory_results.get(i)
+        if sold and inventory_status is not None and is_order_request(request_text):
+            inventory_status = recheck_availability(inventory_status, request_date)
+        if inventory_status is not None and i in quote_results:
+            try:
+                responses.append(complete_request(request_text, request_date, inventory_status, quote_results[i]))
+            except Exception as e:
+                print(f"Orchestrator error: {str(e)}")
+                responses.append(f"We apologize, but we encountered an issue processing your request. Please contact our support team. (Error: {str(e)[:100]})")
         else:
-            final_response = f"""Thank you for your inquiry!
+            responses.append(orchestrate_request(request_text, request_date))
+        sold = sold or is_order_request(request_text)
+    return responses
 
-{quote_response}
+def orchestrate_batch(requests: List[Tuple[str, str]]) -> List[str]:
+    """
+    Orchestrate a batch of (request_text, request_date) pairs.
+    
+    Requests are grouped by date so each group shares one inventory and one
+    quotation agent run; responses are returned in the original order.
+    """
+    groups: Dict[str, List[int]] = {}
+    for index, (_, request_date) in enumerate(requests):
+        groups.setdefault(request_date, []).append(index)
+    
+    responses = [None] * len(requests)
+    for request_date, indices in groups.items():
+        request_texts = [requests[i][0] for i in indices]
+        if len(request_texts) == 1:
+            group_responses = [orchestrate_request(request_texts[0], request_date)]
+        else:
+            try:
+                group_responses = orchestrate_request_group(request_texts, request_date)
+            except Exception as e:
+                print(f"Batch orchestrator error: {str(e)}")
+                group_responses = [orchestrate_request(text, request_date) for text in request_texts]
+        for i, response in zip(indices, group_responses):
+            responses[i] = response
+    return responses
 
-All quoted items are based on current availability. Please let us know if you'd like to proceed with this order."""
-        
-        return final_response
-        
-    except Exception as e:
-        print(f"Orchestrator error: {str(e)}")
-        return f"We apologize, but we encountered an issue processing your request. Please contact our support team. (Error: {str(e)[:100]})"
+class RequestBatcher:
+    """
+    Admission queue in front of the orchestrator that micro-batches concurrent requests.
+    
+    A batch closes once max_batch_size requests are pending or window_seconds have
+    passed since its first request arrived, and is handed to a dispatch thread so
+    the next batch keeps admitting requests while it runs. Batches run one at a
+    time because the worker agents are shared, so a request waits at most
+    window_seconds for its batch to close plus the run time of the batches ahead of it.
+    """
+    def __init__(self, window_seconds: float = BATCH_WINDOW_SECONDS, max_batch_size: int = MAX_BATCH_SIZE):
+        self.window_seconds = window_seconds
+        self.max_batch_size = max_batch_size
+        self.pending = queue.Queue()
+        self.batches = queue.Queue()
+        self.worker = threading.Thread(target=self._run, daemon=True)
+        self.dispatcher = threading.Thread(target=self._dispatch_batches, daemon=True)
+        self.worker.start()
+        self.dispatcher.start()
+    
+    def submit(self, request_text: str, request_date: str) -> Future:
+        future = Future()
+        self.pending.put((request_text, request_date, future))
+        return future
+    
+    def close(self):
+        self.pending.put(None)
+        self.worker.join()
+        self.dispatcher.join()
+    
+    def _run(self):
+        closing = False
+        while not closing:
+            first = self.pending.get()
+            if first is None:
+                break
+            
+            batch = [first]
+            deadline = time.monotonic() + self.window_seconds
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    entry = self.pending.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if entry is None:
+                    closing = True
+                    break
+                batch.append(entry)
+            
+            self.batches.put(batch)
+        self.batches.put(None)
+    
+    def _dispatch_batches(self):
+        while True:
+            batch = self.batches.get()
+            if batch is None:
+                return
+            self._dispatch(batch)
+    
+    def _dispatch(self, batch: List[Tuple[str, str, Future]]):
+        try:
+            responses = orchestrate_batch([(request_text, request_date) for request_text, request_date, _ in batch])
+            for (_, _, future), response in zip(batch, responses):
+                future.set_result(response)
+        except Exception as e:
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
 
 def run_test_scenarios():
     print("=" * 60)
     print("INITIALIZING DATABASE...")
     print("=" * 60)
     init_database(db_engine=db_engine)
+    load_step_stats()
     
     try:
         df = pd.read_csv("quote_requests_sample.csv")
@@ -769,8 +1461,15 @@ def run_test_scenarios():
     print(f"Final Cash: ${final_report['cash_balance']:.2f}")
     print(f"Final Inventory: ${final_report['inventory_value']:.2f}")
     print(f"Total Assets: ${final_report['total_assets']:.2f}")
+    for name, avg_steps in average_steps_per_run().items():
+        print(f"Average {name} steps: {avg_steps:.2f}")
+    memo = memo_summary()
+    print(f"Memoized reads per request: {memo['hits']:.1f} hits, {memo['misses']:.1f} misses, "
+          f"{memo['invalidations']:.1f} invalidated")
     print("="*60)
     
+    save_step_stats()
+    
     pd.DataFrame(results).to_csv("test_results.csv", index=False)
     print("\nResults saved to test_results.csv")
     